@@ -1,16 +1,36 @@
 import asyncio
 import logging
 import html
+import json
+import pickle
+import sqlite3
+import threading
+import time
+import sys
+import functools
+from bisect import bisect_left
+import subprocess
+import zlib
+from collections import Counter, OrderedDict, deque
+from datetime import timedelta
 from telegram import Update, InputMediaPhoto, InputMediaVideo
+from telegram.error import BadRequest, RetryAfter
+from telegram.request import BaseRequest
 from telegram.ext import (
     Application,
+    ApplicationHandlerStop,
+    BaseRateLimiter,
+    BasePersistence,
+    BaseUpdateProcessor,
     CommandHandler,
     MessageHandler,
+    TypeHandler,
     ContextTypes,
     filters
 )
 
 import os
+import httpx
 
 # ------------------------------
 # Configurações
@@ -18,6 +38,66 @@ import os
 # Coloque seu token diretamente aqui (atenção: evite expor esse token em produção)
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 ADMIN_ID = int(os.getenv("ADMIN_ID"))
+# Limites de envio da API do Telegram
+MSGS_POR_SEGUNDO = float(os.getenv("MSGS_POR_SEGUNDO", "30"))
+MSGS_POR_CHAT_SEGUNDO = float(os.getenv("MSGS_POR_CHAT_SEGUNDO", "1"))
+ADMIN_MSGS_POR_MINUTO = float(os.getenv("ADMIN_MSGS_POR_MINUTO", "20"))
+# Com mais envios que isso na fila do chat do admin, os textos passam a ir num resumo agrupado
+ADMIN_MAX_PENDENTES = int(os.getenv("ADMIN_MAX_PENDENTES", "10"))
+# Tempo máximo (segundos) para entregar os envios pendentes ao admin ao desligar
+ENCERRAMENTO_MAX = float(os.getenv("ENCERRAMENTO_MAX", "20"))
+# Processamento concorrente de updates
+MAX_USUARIOS_CONCORRENTES = int(os.getenv("MAX_USUARIOS_CONCORRENTES", "32"))
+MAX_PENDENTES_POR_USUARIO = int(os.getenv("MAX_PENDENTES_POR_USUARIO", "50"))
+# Janela de silêncio (segundos) para considerar um álbum completo
+ALBUM_JANELA_MIN = float(os.getenv("ALBUM_JANELA_MIN", "0.5"))
+ALBUM_JANELA_MAX = float(os.getenv("ALBUM_JANELA_MAX", "3"))
+# Repassa mídias com copy_messages (1 chamada por destino); "0" volta ao send_media_group
+RELAY_COPIA = os.getenv("RELAY_COPIA", "1") != "0"
+# Máximo de mensagens por chamada de copy_messages
+LOTE_COPIA = 100
+# Modo resumo: agrupa os textos recebidos em poucas mensagens ao admin
+ADMIN_DIGEST = os.getenv("ADMIN_DIGEST", "0") == "1"
+DIGEST_ATRASO_MAX = float(os.getenv("DIGEST_ATRASO_MAX", "5"))
+# Limite de caracteres de uma mensagem do Telegram
+LIMITE_MENSAGEM = 4096
+# Modo de recebimento: "polling" (padrão) ou "webhook"
+MODO = os.getenv("MODO", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+PORT = int(os.getenv("PORT", "8443"))
+# Com mais de um worker, um receptor distribui os updates por chat_id
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "1"))
+WORKER_PORTA_BASE = int(os.getenv("WORKER_PORTA_BASE", "9000"))
+WORKER_INDICE = os.getenv("WORKER_INDICE")
+# Todos os workers enviam pelo mesmo bot e ao mesmo admin: cada um fica com uma fração
+# das cotas compartilhadas (global e chat do admin), para que a soma respeite os limites
+ADMIN_RAJADA = 3
+if WORKER_INDICE is not None and WEBHOOK_WORKERS > 1:
+    MSGS_POR_SEGUNDO /= WEBHOOK_WORKERS
+    ADMIN_MSGS_POR_MINUTO /= WEBHOOK_WORKERS
+    ADMIN_RAJADA = max(1, ADMIN_RAJADA // WEBHOOK_WORKERS)
+# Reinícios de um worker tolerados por minuto antes de desligar o receptor
+WORKER_MAX_REINICIOS = int(os.getenv("WORKER_MAX_REINICIOS", "5"))
+# Permite apontar o bot para outro servidor da Bot API (ex.: fake_telegram.py)
+TELEGRAM_BASE_URL = os.getenv("TELEGRAM_BASE_URL")
+# Banco SQLite para persistir user_data/chat_data/bot_data (desativado se vazio)
+PERSISTENCIA_DB = os.getenv("PERSISTENCIA_DB")
+# Controle de entrada por usuário: mensagens por minuto, rajada e política ao exceder
+# ("descartar", "atrasar" ou "silenciar" o usuário por ENTRADA_SILENCIO segundos)
+ENTRADA_POR_MINUTO = float(os.getenv("ENTRADA_POR_MINUTO", "30"))
+ENTRADA_RAJADA = float(os.getenv("ENTRADA_RAJADA", "15"))
+ENTRADA_POLITICA = os.getenv("ENTRADA_POLITICA", "descartar")
+ENTRADA_SILENCIO = float(os.getenv("ENTRADA_SILENCIO", "300"))
+ENTRADA_MAX_USUARIOS = int(os.getenv("ENTRADA_MAX_USUARIOS", "10000"))
+# Erros repetidos são resumidos ao admin a cada ERROS_INTERVALO segundos
+ERROS_INTERVALO = float(os.getenv("ERROS_INTERVALO", "60"))
+# Porta local do endpoint de métricas no formato Prometheus (desativado se vazio);
+# com vários workers, o worker i usa METRICS_PORT + i
+METRICS_PORT = os.getenv("METRICS_PORT")
+# Registra apenas 1 a cada N logs por requisição do httpx (avisos e erros sempre passam)
+LOG_AMOSTRAGEM = int(os.getenv("LOG_AMOSTRAGEM", "100"))
 # Configuração de logging
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -25,6 +105,24 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+class AmostragemDeLog(logging.Filter):
+    """
+    Deixa passar apenas 1 a cada `n` registros abaixo de WARNING.
+    """
+    def __init__(self, n: int) -> None:
+        super().__init__()
+        self.n = max(1, n)
+        self._contador = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        self._contador += 1
+        return (self._contador - 1) % self.n == 0
+
+# Cada getUpdates/sendMessage gera um log INFO do httpx
+logging.getLogger("httpx").addFilter(AmostragemDeLog(LOG_AMOSTRAGEM))
+
 # ------------------------------
 # Funções Auxiliares
 # ------------------------------
@@ -41,16 +139,9 @@ def safe_escape(text: str) -> str:
 async def notificar_erro(context: ContextTypes.DEFAULT_TYPE, error: Exception, user_id: int = None) -> None:
     """
     Notifica o administrador em caso de erro.
+    Repetições do mesmo erro são agregadas num resumo periódico (ver `AgregadorDeErros`).
     """
-    error_message = (
-        f"❌ <b>Erro Detectado:</b>\n\n"
-        f"<b>Detalhes:</b> {error}\n"
-        f"<b>Usuário:</b> {user_id or 'Desconhecido'}"
-    )
-    try:
-        await context.bot.send_message(chat_id=ADMIN_ID, text=error_message, parse_mode="HTML")
-    except Exception as e:
-        logger.critical(f"Erro ao notificar o admin: {e}")
+    await agregador_erros.registrar(context.bot, error, user_id)
 
 async def enviar_info_usuario(user_id: int, user_name: str, username: str, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
@@ -64,6 +155,36 @@ async def enviar_info_usuario(user_id: int, user_name: str, username: str, conte
     )
     await context.bot.send_message(chat_id=ADMIN_ID, text=user_info, parse_mode="HTML")
 
+async def enviar_ao_admin(context: ContextTypes.DEFAULT_TYPE, user_id: int, **kwargs) -> None:
+    """
+    Envia uma mensagem ao administrador, notificando em caso de falha.
+    """
+    try:
+        await context.bot.send_message(chat_id=ADMIN_ID, **kwargs)
+    except Exception as e:
+        await notificar_erro(context, e, user_id=user_id)
+
+def fila_admin_cheia(context: ContextTypes.DEFAULT_TYPE) -> bool:
+    """
+    Indica se a fila do chat do admin atingiu ADMIN_MAX_PENDENTES, contando também os
+    envios agendados que ainda não chegaram ao limitador.
+    """
+    if len(envios_admin) >= ADMIN_MAX_PENDENTES:
+        return True
+    limitador = context.bot.rate_limiter
+    return isinstance(limitador, LimitadorDeEnvio) and limitador.pendentes(ADMIN_ID) >= ADMIN_MAX_PENDENTES
+
+# Envios ao admin em segundo plano; aguardados (com limite de tempo) em `encerrar_pendentes`
+envios_admin = set()
+
+def agendar_envio_admin(coroutine) -> None:
+    """
+    Executa um envio ao admin em segundo plano, sem prender o handler.
+    """
+    tarefa = asyncio.create_task(coroutine)
+    envios_admin.add(tarefa)
+    tarefa.add_done_callback(envios_admin.discard)
+
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     Captura e registra erros não tratados.
@@ -74,6 +195,1194 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> N
         await update.effective_message.reply_text(error_msg)
     await notificar_erro(context, context.error)
 
+# ------------------------------
+# Métricas
+# ------------------------------
+class Histograma:
+    """
+    Histograma de durações (segundos) com faixas fixas, no estilo Prometheus.
+    """
+    FAIXAS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+    __slots__ = ("contagens", "soma", "total")
+
+    def __init__(self) -> None:
+        self.contagens = [0] * (len(self.FAIXAS) + 1)
+        self.soma = 0.0
+        self.total = 0
+
+    def observar(self, segundos: float) -> None:
+        self.contagens[bisect_left(self.FAIXAS, segundos)] += 1
+        self.soma += segundos
+        self.total += 1
+
+    def percentil(self, p: float) -> float:
+        """
+        Limite superior da faixa que contém o percentil `p` (infinito acima de 10 s).
+        """
+        alvo = p / 100 * self.total
+        acumulado = 0
+        for limite, contagem in zip(self.FAIXAS + (float("inf"),), self.contagens):
+            acumulado += contagem
+            if acumulado >= alvo:
+                return limite
+        return float("inf")
+
+class Metricas:
+    """
+    Métricas do caminho crítico: latência por handler, latência e 429 por método da API,
+    profundidade da fila de updates e ocupação do agrupador de álbuns.
+    """
+
+    def __init__(self) -> None:
+        self.handlers: dict[str, Histograma] = {}
+        self.api: dict[str, Histograma] = {}
+        self.api_429 = Counter()
+        self.entrada = Counter()
+        self.admin_resumidos = 0
+        self.aplicacao = None
+        self.servidor = None
+
+    def observar_handler(self, nome: str, segundos: float) -> None:
+        histograma = self.handlers.get(nome) or self.handlers.setdefault(nome, Histograma())
+        histograma.observar(segundos)
+
+    def observar_api(self, metodo: str, segundos: float) -> None:
+        histograma = self.api.get(metodo) or self.api.setdefault(metodo, Histograma())
+        histograma.observar(segundos)
+
+    def medidores(self) -> dict:
+        """
+        Valores instantâneos (filas e buffers).
+        """
+        fila = pendentes = aguardando_vaga = 0
+        if self.aplicacao is not None:
+            # A update_queue fica quase sempre vazia (a PTB a esvazia em seguida); o backlog
+            # real está nas filas por chat do ProcessadorPorUsuario
+            fila = self.aplicacao.update_queue.qsize()
+            processador = self.aplicacao.update_processor
+            if isinstance(processador, ProcessadorPorUsuario):
+                pendentes = processador.pendentes
+                aguardando_vaga = processador.chats_aguardando_vaga
+        return {
+            "fila_updates": fila,
+            "updates_pendentes_por_chat": pendentes,
+            "chats_aguardando_vaga": aguardando_vaga,
+            "albuns_em_andamento": len(agregador_albuns),
+            "albuns_itens": agregador_albuns.itens,
+            "digest_pendentes": len(digesto_admin),
+            "envios_admin_pendentes": len(envios_admin),
+            "usuarios_monitorados": len(controle_entrada),
+            "updates_atrasados": controle_entrada.atrasados,
+        }
+
+    def resumo(self) -> str:
+        """
+        Resumo em HTML para o comando /stats.
+        """
+        def ms(segundos: float) -> str:
+            return ">10 s" if segundos == float("inf") else f"{segundos * 1000:g} ms"
+
+        linhas = ["📊 <b>Estatísticas</b>", ""]
+        if WORKER_INDICE is not None:
+            # Cada worker tem suas próprias métricas; o /stats é respondido pelo worker do chat do admin
+            linhas += [f"ℹ️ Apenas do worker {WORKER_INDICE} de {WEBHOOK_WORKERS} (os demais não estão incluídos)", ""]
+        linhas.append("<b>Handlers</b> (n · p50 · p99)")
+        for nome, h in sorted(self.handlers.items()):
+            linhas.append(f"• {nome}: {h.total} · {ms(h.percentil(50))} · {ms(h.percentil(99))}")
+        linhas += ["", "<b>API</b> (n · p50 · p99 · 429)"]
+        for metodo, h in sorted(self.api.items()):
+            linhas.append(
+                f"• {metodo}: {h.total} · {ms(h.percentil(50))} · {ms(h.percentil(99))} · {self.api_429[metodo]}"
+            )
+        linhas += ["", f"<b>Textos enviados ao admin em resumo</b> (fila cheia): {self.admin_resumidos}"]
+        linhas += ["", "<b>Entrada</b> (acima do limite)"]
+        linhas += [f"• {acao}: {total}" for acao, total in sorted(self.entrada.items())]
+        linhas += ["", "<b>Filas</b>"]
+        linhas += [f"• {nome}: {valor}" for nome, valor in self.medidores().items()]
+        return "\n".join(linhas)
+
+    def prometheus(self) -> str:
+        """
+        Métricas no formato de texto do Prometheus.
+        """
+        linhas = []
+
+        def histograma(nome: str, rotulo: str, histogramas: dict) -> None:
+            linhas.append(f"# TYPE {nome} histogram")
+            for valor, h in sorted(histogramas.items()):
+                acumulado = 0
+                for limite, contagem in zip(Histograma.FAIXAS + ("+Inf",), h.contagens):
+                    acumulado += contagem
+                    linhas.append(f'{nome}_bucket{{{rotulo}="{valor}",le="{limite}"}} {acumulado}')
+                linhas.append(f'{nome}_sum{{{rotulo}="{valor}"}} {h.soma}')
+                linhas.append(f'{nome}_count{{{rotulo}="{valor}"}} {h.total}')
+
+        histograma("bot_handler_latencia_segundos", "handler", self.handlers)
+        histograma("bot_api_latencia_segundos", "metodo", self.api)
+        linhas.append("# TYPE bot_api_429_total counter")
+        linhas += [f'bot_api_429_total{{metodo="{metodo}"}} {total}' for metodo, total in sorted(self.api_429.items())]
+        linhas.append("# TYPE bot_admin_resumidos_total counter")
+        linhas.append(f"bot_admin_resumidos_total {self.admin_resumidos}")
+        linhas.append("# TYPE bot_entrada_limitada_total counter")
+        linhas += [f'bot_entrada_limitada_total{{acao="{acao}"}} {total}' for acao, total in sorted(self.entrada.items())]
+        for nome, valor in self.medidores().items():
+            linhas.append(f"# TYPE bot_{nome} gauge")
+            linhas.append(f"bot_{nome} {valor}")
+        return "\n".join(linhas) + "\n"
+
+metricas = Metricas()
+
+def medido(funcao):
+    """
+    Registra a duração de cada chamada do handler em `metricas`.
+    """
+    @functools.wraps(funcao)
+    async def envoltorio(*args, **kwargs):
+        inicio = time.perf_counter()
+        try:
+            return await funcao(*args, **kwargs)
+        finally:
+            metricas.observar_handler(funcao.__name__, time.perf_counter() - inicio)
+    return envoltorio
+
+async def _responder_metricas(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        # Descarta a requisição; qualquer caminho devolve as métricas
+        while (await reader.readline()).strip():
+            pass
+        corpo = metricas.prometheus().encode()
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+            + f"Content-Length: {len(corpo)}\r\nConnection: close\r\n\r\n".encode()
+            + corpo
+        )
+        await writer.drain()
+    finally:
+        writer.close()
+
+async def iniciar_metricas(application: Application) -> None:
+    """
+    Liga as métricas à aplicação e, se configurado, sobe o endpoint Prometheus local.
+    """
+    metricas.aplicacao = application
+    if METRICS_PORT:
+        porta = int(METRICS_PORT) + int(WORKER_INDICE or 0)
+        metricas.servidor = await asyncio.start_server(_responder_metricas, "127.0.0.1", porta)
+        logger.info(f"Métricas em http://127.0.0.1:{porta}/metrics")
+
+async def parar_metricas(application: Application) -> None:
+    """
+    Encerra o endpoint de métricas, se estiver ativo.
+    """
+    if metricas.servidor is not None:
+        metricas.servidor.close()
+        await metricas.servidor.wait_closed()
+        metricas.servidor = None
+
+# ------------------------------
+# Controle de Envio
+# ------------------------------
+def _segundos(valor) -> float:
+    """
+    Converte um `retry_after` (int, float ou timedelta) em segundos.
+    """
+    if isinstance(valor, timedelta):
+        return valor.total_seconds()
+    return float(valor)
+
+class BaldeDeTokens:
+    """
+    Balde de tokens: libera `taxa` envios por segundo, acumulando até `capacidade`.
+    """
+    __slots__ = ("taxa", "capacidade", "_tokens", "_ultimo", "_trava")
+
+    def __init__(self, taxa: float, capacidade: float) -> None:
+        self.taxa = taxa
+        self.capacidade = capacidade
+        self._tokens = capacidade
+        self._ultimo = time.monotonic()
+        self._trava = asyncio.Lock()
+
+    def _repor(self) -> None:
+        agora = time.monotonic()
+        self._tokens = min(self.capacidade, self._tokens + (agora - self._ultimo) * self.taxa)
+        self._ultimo = agora
+
+    def tentar(self) -> float:
+        """
+        Consome um token se houver; caso contrário, retorna quantos segundos faltam para o próximo.
+        """
+        self._repor()
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / self.taxa
+
+    def reservar(self) -> float:
+        """
+        Consome um token mesmo sem saldo (que fica negativo) e retorna em quantos segundos
+        ele estaria disponível; quem reservar depois recebe um prazo maior.
+        """
+        self._repor()
+        self._tokens -= 1
+        return max(0.0, -self._tokens / self.taxa)
+
+    @property
+    def cheio(self) -> bool:
+        self._repor()
+        return self._tokens >= self.capacidade
+
+    async def adquirir(self) -> None:
+        """
+        Aguarda (em ordem de chegada) até conseguir um token.
+        """
+        async with self._trava:
+            while (espera := self.tentar()) > 0:
+                await asyncio.sleep(espera)
+
+class _Destino:
+    """
+    Fila de envio de um chat: trava FIFO + balde de tokens próprio.
+    """
+    __slots__ = ("fila", "balde", "pendentes")
+
+    def __init__(self, balde: BaldeDeTokens) -> None:
+        self.fila = asyncio.Lock()
+        self.balde = balde
+        self.pendentes = 0
+
+class LimitadorDeEnvio(BaseRateLimiter[dict]):
+    """
+    Agenda as chamadas `bot.send_*` respeitando os limites do Telegram: um balde global,
+    um balde por chat (mais restrito no chat do administrador) e backoff em `retry_after`.
+    Cada destino tem sua própria fila, então o eco ao usuário nunca espera o backlog do admin.
+    """
+    # Acima deste número de destinos, os ociosos são descartados
+    LIMPAR_ACIMA = 1000
+
+    def __init__(
+        self,
+        msgs_por_segundo: float = MSGS_POR_SEGUNDO,
+        msgs_por_chat_segundo: float = MSGS_POR_CHAT_SEGUNDO,
+        admin_msgs_por_minuto: float = ADMIN_MSGS_POR_MINUTO,
+        admin_rajada: float = ADMIN_RAJADA,
+        max_tentativas: int = 3,
+    ) -> None:
+        self.msgs_por_chat_segundo = msgs_por_chat_segundo
+        self.admin_msgs_por_minuto = admin_msgs_por_minuto
+        self.admin_rajada = admin_rajada
+        self.max_tentativas = max_tentativas
+        self._global = BaldeDeTokens(msgs_por_segundo, max(1, msgs_por_segundo))
+        self._destinos: dict[str, _Destino] = {}
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        self._destinos.clear()
+
+    def _destino(self, chave: str) -> _Destino:
+        destino = self._destinos.get(chave)
+        if destino is None:
+            if len(self._destinos) >= self.LIMPAR_ACIMA:
+                self._limpar_ociosos()
+            if chave == str(ADMIN_ID):
+                # Chat do admin: até 20 mensagens por minuto, com pequena rajada
+                balde = BaldeDeTokens(self.admin_msgs_por_minuto / 60, self.admin_rajada)
+            else:
+                balde = BaldeDeTokens(self.msgs_por_chat_segundo, 1)
+            destino = self._destinos[chave] = _Destino(balde)
+        return destino
+
+    def pendentes(self, chat_id) -> int:
+        """
+        Envios aguardando (ou em andamento) na fila de `chat_id`.
+        """
+        destino = self._destinos.get(str(chat_id))
+        return destino.pendentes if destino is not None else 0
+
+    def _limpar_ociosos(self) -> None:
+        """
+        Remove destinos sem envios pendentes e com o balde cheio (sem estado a preservar).
+        """
+        for chave, destino in list(self._destinos.items()):
+            if not destino.pendentes and destino.balde.cheio:
+                del self._destinos[chave]
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get("chat_id")
+        if chat_id is None:
+            # Chamadas sem destino (getMe, setWebhook...) não entram nas filas
+            inicio = time.perf_counter()
+            try:
+                return await callback(*args, **kwargs)
+            finally:
+                metricas.observar_api(endpoint, time.perf_counter() - inicio)
+
+        max_tentativas = (rate_limit_args or {}).get("max_tentativas", self.max_tentativas)
+        destino = self._destino(str(chat_id))
+        destino.pendentes += 1
+        try:
+            async with destino.fila:
+                tentativa = 0
+                while True:
+                    await destino.balde.adquirir()
+                    await self._global.adquirir()
+                    inicio = time.perf_counter()
+                    try:
+                        return await callback(*args, **kwargs)
+                    except RetryAfter as e:
+                        metricas.api_429[endpoint] += 1
+                        if tentativa >= max_tentativas:
+                            raise
+                        tentativa += 1
+                        espera = _segundos(e.retry_after)
+                        logger.warning(f"429 em {endpoint} para {chat_id}: aguardando {espera}s")
+                        # A fila deste destino fica parada; os demais seguem normalmente
+                        await asyncio.sleep(espera)
+                    finally:
+                        metricas.observar_api(endpoint, time.perf_counter() - inicio)
+        finally:
+            destino.pendentes -= 1
+
+# ------------------------------
+# Processamento de Updates
+# ------------------------------
+class ProcessadorPorUsuario(BaseUpdateProcessor):
+    """
+    Processa updates de usuários diferentes em paralelo (até `max_concurrent_updates`),
+    mantendo a ordem estrita dos updates de um mesmo chat.
+
+    Cada chat tem uma fila limitada; o primeiro update de um chat ocioso vira o
+    executor daquela fila e a esvazia ocupando uma única vaga de concorrência.
+    Enfileirar (ou descartar, com a fila cheia) não ocupa vaga, então os updates que
+    aguardam ficam sempre nas filas limitadas, e não em tarefas esperando o semáforo.
+    """
+
+    def __init__(
+        self,
+        max_concurrent_updates: int = MAX_USUARIOS_CONCORRENTES,
+        max_pendentes_por_chat: int = MAX_PENDENTES_POR_USUARIO,
+    ) -> None:
+        super().__init__(max_concurrent_updates)
+        self.max_pendentes_por_chat = max_pendentes_por_chat
+        self._filas: dict[object, deque] = {}
+        self.chats_aguardando_vaga = 0
+
+    @staticmethod
+    def _chave(update: object) -> object:
+        if isinstance(update, Update) and update.effective_chat:
+            return update.effective_chat.id
+        # Updates sem chat (ou que não são do Telegram) formam uma fila própria
+        return None
+
+    @property
+    def pendentes(self) -> int:
+        """
+        Updates enfileirados aguardando o executor do seu chat (ou uma vaga para ele).
+        """
+        return sum(len(fila) for fila in self._filas.values())
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        for fila in self._filas.values():
+            for coroutine in fila:
+                coroutine.close()
+        self._filas.clear()
+
+    async def process_update(self, update, coroutine) -> None:
+        # A versão da PTB toma a vaga antes de `do_process_update`; aqui só o executor a ocupa
+        chave = self._chave(update)
+        fila = self._filas.get(chave)
+        if fila is not None:
+            # Já existe um executor para este chat: apenas enfileira
+            if len(fila) >= self.max_pendentes_por_chat:
+                logger.warning(f"Fila do chat {chave} cheia; update descartado")
+                coroutine.close()
+                controle_entrada.esquecer(update)
+                return
+            fila.append(coroutine)
+            return
+
+        fila = self._filas[chave] = deque((coroutine,))
+        try:
+            self.chats_aguardando_vaga += 1
+            try:
+                await self._semaphore.acquire()
+            finally:
+                self.chats_aguardando_vaga -= 1
+            try:
+                await self.do_process_update(update, coroutine)
+            finally:
+                self._semaphore.release()
+        finally:
+            self._filas.pop(chave, None)
+            # Se o executor foi cancelado, descarta o que ficou na fila
+            for pendente in fila:
+                pendente.close()
+
+    async def do_process_update(self, update, coroutine) -> None:
+        """
+        Esvazia a fila do chat do update, em ordem.
+        """
+        chave = self._chave(update)
+        fila = self._filas[chave]
+        while fila:
+            try:
+                await fila.popleft()
+            except Exception as e:
+                # Application.process_update já trata os erros dos handlers
+                logger.error(f"Erro ao processar update do chat {chave}: {e}")
+
+# ------------------------------
+# Controle de Entrada
+# ------------------------------
+class _EstadoEntrada:
+    __slots__ = ("balde", "silenciado_ate", "avisado", "grupo", "grupo_liberacao")
+
+    def __init__(self, balde: BaldeDeTokens) -> None:
+        self.balde = balde
+        self.silenciado_ate = 0.0
+        # Se o usuário já foi avisado do descarte (volta a False quando um update passa)
+        self.avisado = False
+        # Último álbum visto e quando seus itens são liberados (None = descartado)
+        self.grupo = None
+        self.grupo_liberacao = None
+
+class ControleDeEntrada:
+    """
+    Limita os updates aceitos de cada usuário com um balde de tokens, antes dos handlers.
+
+    Ao exceder o limite, a política define o que acontece com o update:
+    - "descartar": é ignorado;
+    - "atrasar": é devolvido à fila de updates quando houver token (até `max_atraso`
+      segundos, senão é ignorado), sem ocupar uma vaga de processamento enquanto espera;
+    - "silenciar": é ignorado, assim como tudo do usuário pelos próximos `silencio` segundos.
+
+    Um álbum consome um único token: a decisão tomada para o primeiro item (aceitar, atrasar
+    ou descartar) vale para os demais itens do mesmo `media_group_id`, então ele nunca chega
+    pela metade. O usuário é avisado uma vez quando algo dele é descartado.
+
+    Os estados ficam num LRU limitado a `max_usuarios`, então a memória não cresce com o
+    número de usuários. O administrador nunca é limitado.
+    """
+    POLITICAS = ("descartar", "atrasar", "silenciar")
+
+    def __init__(
+        self,
+        por_minuto: float = ENTRADA_POR_MINUTO,
+        rajada: float = ENTRADA_RAJADA,
+        politica: str = ENTRADA_POLITICA,
+        silencio: float = ENTRADA_SILENCIO,
+        max_usuarios: int = ENTRADA_MAX_USUARIOS,
+        max_atraso: float = 30,
+    ) -> None:
+        if politica not in self.POLITICAS:
+            raise ValueError(f"Política de entrada inválida: {politica}")
+        self.por_minuto = por_minuto
+        self.rajada = rajada
+        self.politica = politica
+        self.silencio = silencio
+        self.max_usuarios = max_usuarios
+        self.max_atraso = max_atraso
+        self._usuarios: OrderedDict[int, _EstadoEntrada] = OrderedDict()
+        # update_ids já atrasados, que passam direto ao voltarem para a fila
+        self._liberados = set()
+        # Updates aguardando o prazo para voltar à fila: update_id -> (timer, update)
+        self._atrasados: dict[int, tuple] = {}
+
+    def __len__(self) -> int:
+        return len(self._usuarios)
+
+    @property
+    def atrasados(self) -> int:
+        return len(self._atrasados)
+
+    def _estado(self, user_id: int) -> _EstadoEntrada:
+        estado = self._usuarios.get(user_id)
+        if estado is None:
+            estado = self._usuarios[user_id] = _EstadoEntrada(BaldeDeTokens(self.por_minuto / 60, self.rajada))
+            if len(self._usuarios) > self.max_usuarios:
+                self._usuarios.popitem(last=False)
+        else:
+            self._usuarios.move_to_end(user_id)
+        return estado
+
+    def _atrasar(self, update: Update, context: ContextTypes.DEFAULT_TYPE, segundos: float) -> None:
+        """
+        Devolve o update à fila de updates daqui a `segundos`, sem ocupar uma vaga de processamento.
+        """
+        metricas.entrada["atrasado"] += 1
+        self._liberados.add(update.update_id)
+        timer = asyncio.get_running_loop().call_later(segundos, self._liberar, update, context.application)
+        self._atrasados[update.update_id] = (timer, update)
+
+    def _liberar(self, update: Update, application: Application) -> None:
+        self._atrasados.pop(update.update_id, None)
+        application.update_queue.put_nowait(update)
+
+    def esquecer(self, update: object) -> None:
+        """
+        Chamado quando um update é descartado antes de passar por `controlar`.
+        """
+        if isinstance(update, Update):
+            self._liberados.discard(update.update_id)
+
+    async def encerrar(self, bot) -> None:
+        """
+        Cancela os updates ainda atrasados e avisa cada usuário de quantos não foram entregues.
+        """
+        por_chat = Counter()
+        for timer, update in self._atrasados.values():
+            timer.cancel()
+            if update.effective_chat:
+                por_chat[update.effective_chat.id] += 1
+        self._atrasados.clear()
+        self._liberados.clear()
+
+        async def avisar(chat_id: int, total: int) -> None:
+            try:
+                await bot.send_message(
+                    chat_id=chat_id,
+                    text=f"⚠️ O bot foi reiniciado antes de entregar {total} mensagem(ns) sua(s). Envie novamente.",
+                )
+            except Exception as e:
+                logger.error(f"Erro ao avisar {chat_id} sobre mensagens não entregues: {e}")
+
+        if por_chat:
+            logger.warning(f"Desligamento: {sum(por_chat.values())} updates atrasados não foram entregues")
+            await asyncio.gather(*(avisar(chat_id, total) for chat_id, total in por_chat.items()))
+
+    async def controlar(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """
+        Handler do grupo -1: interrompe o processamento dos updates acima do limite.
+        """
+        user = update.effective_user
+        if user is None or user.id == ADMIN_ID:
+            return
+        if update.update_id in self._liberados:
+            self._liberados.discard(update.update_id)
+            return
+        estado = self._estado(user.id)
+        message = update.effective_message
+        grupo = message.media_group_id if message else None
+        if grupo is not None and grupo == estado.grupo:
+            # Demais itens de um álbum: seguem a decisão tomada para o primeiro
+            if estado.grupo_liberacao is None:
+                metricas.entrada["descartado"] += 1
+                raise ApplicationHandlerStop
+            atraso = estado.grupo_liberacao - time.monotonic()
+            if atraso > 0:
+                self._atrasar(update, context, atraso)
+                raise ApplicationHandlerStop
+            return
+
+        if estado.silenciado_ate > time.monotonic():
+            metricas.entrada["silenciado"] += 1
+            raise ApplicationHandlerStop
+
+        espera = estado.balde.tentar()
+        if not espera:
+            estado.avisado = False
+            if grupo is not None:
+                estado.grupo, estado.grupo_liberacao = grupo, 0.0
+            return
+        if self.politica == "atrasar" and espera <= self.max_atraso:
+            # Esperar aqui prenderia a vaga do chat no ProcessadorPorUsuario; em vez disso o
+            # token é reservado e o update volta à fila no prazo. Reservas posteriores têm
+            # prazos maiores, então a ordem dos updates do usuário se mantém
+            atraso = estado.balde.reservar()
+            if grupo is not None:
+                estado.grupo, estado.grupo_liberacao = grupo, time.monotonic() + atraso
+            self._atrasar(update, context, atraso)
+            raise ApplicationHandlerStop
+
+        if grupo is not None:
+            estado.grupo, estado.grupo_liberacao = grupo, None
+        metricas.entrada["descartado"] += 1
+        if self.politica == "silenciar":
+            estado.silenciado_ate = time.monotonic() + self.silencio
+            aviso = "⚠️ Muitas mensagens em pouco tempo. Aguarde alguns minutos para enviar novamente."
+        else:
+            aviso = "⚠️ Muitas mensagens em pouco tempo; esta não foi entregue. Aguarde um pouco e envie novamente."
+        if message and not estado.avisado:
+            estado.avisado = True
+            await message.reply_text(aviso)
+        raise ApplicationHandlerStop
+
+controle_entrada = ControleDeEntrada()
+
+class AgregadorDeErros:
+    """
+    Evita uma mensagem ao admin por falha: a primeira ocorrência de cada erro é enviada
+    na hora, e as repetições dentro de `intervalo` segundos viram um único resumo com contagens.
+    """
+    MAX_ASSINATURAS = 100
+    MAX_USUARIOS_EXEMPLO = 5
+
+    def __init__(self, intervalo: float = ERROS_INTERVALO) -> None:
+        self.intervalo = intervalo
+        self._vistos = set()
+        self._repeticoes: dict[tuple, list] = {}
+        self._bot = None
+        self._tarefa = None
+
+    async def _enviar(self, texto: str) -> None:
+        try:
+            await self._bot.send_message(chat_id=ADMIN_ID, text=texto, parse_mode="HTML")
+        except Exception as e:
+            logger.critical(f"Erro ao notificar o admin: {e}")
+
+    async def registrar(self, bot, error: Exception, user_id: int = None) -> None:
+        self._bot = bot
+        assinatura = (type(error).__name__, str(error)[:200])
+        if assinatura not in self._vistos:
+            if len(self._vistos) < self.MAX_ASSINATURAS:
+                self._vistos.add(assinatura)
+                if self._tarefa is None or self._tarefa.done():
+                    self._tarefa = asyncio.create_task(self._ciclo())
+                await self._enviar(
+                    f"❌ <b>Erro Detectado:</b>\n\n"
+                    f"<b>Detalhes:</b> {safe_escape(str(error))}\n"
+                    f"<b>Usuário:</b> {user_id or 'Desconhecido'}"
+                )
+                return
+            assinatura = ("Outros", "erros diversos")
+        repeticao = self._repeticoes.setdefault(assinatura, [0, set()])
+        repeticao[0] += 1
+        if user_id is not None and len(repeticao[1]) < self.MAX_USUARIOS_EXEMPLO:
+            repeticao[1].add(user_id)
+
+    async def _ciclo(self) -> None:
+        while self._vistos:
+            await asyncio.sleep(self.intervalo)
+            await self.descarregar()
+
+    async def descarregar(self) -> None:
+        """
+        Envia o resumo das repetições e inicia uma nova janela.
+        """
+        repeticoes, self._repeticoes = self._repeticoes, {}
+        self._vistos = set()
+        if not repeticoes:
+            return
+        linhas = [f"🔁 <b>Erros repetidos nos últimos {self.intervalo:g} s:</b>", ""]
+        tamanho = sum(_tamanho(linha) + 1 for linha in linhas)
+        for (tipo, detalhes), (contagem, usuarios) in sorted(repeticoes.items(), key=lambda item: -item[1][0]):
+            linha = f"• <b>{contagem}×</b> {tipo}: {safe_escape(detalhes)}"
+            if usuarios:
+                linha += f" (usuários: {', '.join(map(str, sorted(usuarios)))})"
+            if tamanho + _tamanho(linha) + 2 > LIMITE_MENSAGEM:
+                linhas.append("…")
+                break
+            linhas.append(linha)
+            tamanho += _tamanho(linha) + 1
+        await self._enviar("\n".join(linhas))
+
+agregador_erros = AgregadorDeErros()
+
+# ------------------------------
+# Agrupamento de Álbuns
+# ------------------------------
+class Album:
+    """
+    Mídias de um mesmo `media_group_id` (ou uma mídia avulsa) aguardando envio.
+    Cada item de `media` é uma tupla (message_id, tipo, file_id), e `intervalo` é a
+    média móvel do intervalo entre os itens deste álbum (None até o segundo item).
+    """
+    __slots__ = ("user_id", "user_name", "username", "context", "media", "original_captions", "ultimo", "intervalo")
+
+    def __init__(self, user_id: int, user_name: str, username: str, context: ContextTypes.DEFAULT_TYPE) -> None:
+        self.user_id = user_id
+        self.user_name = user_name
+        self.username = username
+        self.context = context
+        self.media = []
+        self.original_captions = []
+        self.ultimo = time.monotonic()
+        self.intervalo = None
+
+class AgregadorDeAlbuns:
+    """
+    Agrupa as mídias recebidas por `media_group_id` e as entrega a `enviar`.
+
+    - Mídias avulsas são entregues imediatamente;
+    - Um álbum é entregue ao atingir 10 itens ou após ficar em silêncio por uma janela
+      adaptativa (3x o intervalo médio entre os itens daquele álbum, entre `janela_min` e
+      `janela_max`). Até o segundo item vale a média geral de todos os álbuns; a partir
+      dele, só os intervalos do próprio álbum, então um usuário com envio lento não atrasa
+      os álbuns dos demais;
+    - Uma única tarefa cuida de todos os prazos, e álbuns entregues são descartados,
+      então a memória depende só dos álbuns em andamento.
+    """
+    TAMANHO_MAXIMO = 10
+
+    def __init__(self, enviar, janela_min: float = ALBUM_JANELA_MIN, janela_max: float = ALBUM_JANELA_MAX) -> None:
+        self._enviar = enviar
+        self.janela_min = janela_min
+        self.janela_max = janela_max
+        self._intervalo_medio = janela_min / 3
+        self._albums: dict[str, Album] = {}
+        self._acordar = None
+        self._tarefa = None
+
+    def __len__(self) -> int:
+        return len(self._albums)
+
+    @property
+    def itens(self) -> int:
+        return sum(len(album.media) for album in self._albums.values())
+
+    def janela(self, album: Album) -> float:
+        intervalo = self._intervalo_medio if album.intervalo is None else album.intervalo
+        return min(self.janela_max, max(self.janela_min, 3 * intervalo))
+
+    def adicionar(self, update: Update, context: ContextTypes.DEFAULT_TYPE, media, caption: str) -> None:
+        """
+        Adiciona uma mídia ao álbum correspondente, entregando-o quando estiver completo.
+        """
+        message = update.message
+        user_id = message.chat_id
+        if message.media_group_id is None:
+            album = self._novo_album(update, context)
+            album.media.append(media)
+            album.original_captions.append(caption)
+            self._despachar(album)
+            return
+
+        chave = f"{user_id}:{message.media_group_id}"
+        agora = time.monotonic()
+        album = self._albums.get(chave)
+        if album is None:
+            album = self._albums[chave] = self._novo_album(update, context)
+            self._iniciar()
+        else:
+            # Médias móveis do intervalo entre itens: a do álbum define a sua janela, e a
+            # geral só serve de estimativa inicial para os próximos álbuns
+            intervalo = agora - album.ultimo
+            self._intervalo_medio = 0.8 * self._intervalo_medio + 0.2 * intervalo
+            album.intervalo = intervalo if album.intervalo is None else 0.5 * album.intervalo + 0.5 * intervalo
+            album.ultimo = agora
+            # O prazo do álbum pode ter diminuído: a tarefa de descarga recalcula o próximo
+            self._acordar.set()
+        album.media.append(media)
+        album.original_captions.append(caption)
+
+        if len(album.media) >= self.TAMANHO_MAXIMO:
+            self._despachar(self._albums.pop(chave))
+
+    @staticmethod
+    def _novo_album(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Album:
+        user = update.message.from_user
+        return Album(update.message.chat_id, user.first_name or "N/A", user.username or "N/A", context)
+
+    def _despachar(self, album: Album) -> None:
+        album.context.application.create_task(self._enviar(album))
+
+    def _iniciar(self) -> None:
+        if self._tarefa is None or self._tarefa.done():
+            self._acordar = asyncio.Event()
+            self._tarefa = asyncio.create_task(self._descarregar())
+        self._acordar.set()
+
+    async def _descarregar(self) -> None:
+        """
+        Tarefa única que entrega os álbuns cujo prazo de silêncio expirou.
+        """
+        while True:
+            self._acordar.clear()
+            if not self._albums:
+                await self._acordar.wait()
+                continue
+            agora = time.monotonic()
+            proximo = None
+            for chave, album in list(self._albums.items()):
+                prazo = album.ultimo + self.janela(album)
+                if prazo <= agora:
+                    self._despachar(self._albums.pop(chave))
+                elif proximo is None or prazo < proximo:
+                    proximo = prazo
+            if proximo is not None:
+                try:
+                    await asyncio.wait_for(self._acordar.wait(), proximo - agora)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def encerrar(self) -> None:
+        """
+        Para a tarefa de descarga e entrega o que ainda estiver pendente.
+        """
+        if self._tarefa is not None:
+            self._tarefa.cancel()
+            self._tarefa = None
+        albums = list(self._albums.values())
+        self._albums.clear()
+        await asyncio.gather(*(self._enviar(album) for album in albums))
+
+# ------------------------------
+# Resumo para o Administrador
+# ------------------------------
+def _tamanho(texto: str) -> int:
+    """
+    Tamanho do texto em unidades UTF-16, como o Telegram conta.
+    """
+    return len(texto.encode("utf-16-le")) // 2
+
+def _dividir_html(texto: str, limite: int) -> list:
+    """
+    Divide um texto já escapado em partes de até `limite` caracteres sem cortar entidades HTML.
+    """
+    partes = []
+    while _tamanho(texto) > limite:
+        corte = limite
+        while _tamanho(texto[:corte]) > limite:
+            corte -= 1
+        # Não separa um "&amp;" ao meio
+        amp = texto.rfind("&", max(0, corte - 8), corte)
+        if amp > 0 and texto.find(";", amp, corte) == -1:
+            corte = amp
+        partes.append(texto[:corte])
+        texto = texto[corte:]
+    partes.append(texto)
+    return partes
+
+class DigestoAdmin:
+    """
+    Acumula os textos repassados ao administrador e os envia agrupados por usuário,
+    no menor número possível de mensagens HTML (cada uma com até 4096 caracteres).
+
+    O envio acontece quando há uma mensagem cheia ou após `atraso_max` segundos
+    do primeiro texto pendente. O cabeçalho de cada usuário aparece uma única vez
+    por mensagem, e os textos de um mesmo usuário mantêm a ordem de chegada.
+    """
+
+    def __init__(self, atraso_max: float = DIGEST_ATRASO_MAX, limite: int = LIMITE_MENSAGEM) -> None:
+        self.atraso_max = atraso_max
+        self.limite = limite
+        self._blocos: dict[int, tuple] = {}
+        self._tamanho = 0
+        self._bot = None
+        self._tarefa = None
+        self._trava = asyncio.Lock()
+
+    def __len__(self) -> int:
+        return sum(len(itens) for _, itens in self._blocos.values())
+
+    @staticmethod
+    def _cabecalho(user_id: int, user_name: str, username: str) -> str:
+        return (
+            f"📩 <b>Mensagens de</b> <code>{user_id}</code>\n"
+            f"🔹 <b>Nome:</b> {safe_escape(user_name)}\n"
+            f"🔹 <b>Username:</b> @{safe_escape(username)}"
+        )
+
+    def adicionar(self, bot, user_id: int, user_name: str, username: str, texto: str) -> None:
+        """
+        Enfileira um texto (já escapado) para o próximo resumo.
+        """
+        self._bot = bot
+        bloco = self._blocos.get(user_id)
+        if bloco is None:
+            cabecalho = self._cabecalho(user_id, user_name, username)
+            bloco = self._blocos[user_id] = (cabecalho, [])
+            self._tamanho += _tamanho(cabecalho)
+        item = f"🕒 {time.strftime('%H:%M:%S')}\n{texto}"
+        bloco[1].append(item)
+        self._tamanho += _tamanho(item) + 2
+
+        if self._tamanho >= self.limite:
+            self._agendar(0)
+        elif self._tarefa is None:
+            self._agendar(self.atraso_max)
+
+    def _agendar(self, atraso: float) -> None:
+        if self._tarefa is not None:
+            self._tarefa.cancel()
+        self._tarefa = asyncio.create_task(self._descarregar_em(atraso))
+
+    async def _descarregar_em(self, atraso: float) -> None:
+        await asyncio.sleep(atraso)
+        self._tarefa = None
+        await self.descarregar()
+
+    def _montar(self, blocos) -> list:
+        """
+        Empacota os blocos em mensagens de até `limite` caracteres.
+        """
+        mensagens = []
+        atual, tamanho_atual = [], 0
+        for cabecalho, itens in blocos:
+            tamanho_cabecalho = _tamanho(cabecalho)
+            corpo, tamanho_corpo = [], 0
+            for item in itens:
+                for parte in _dividir_html(item, self.limite - tamanho_cabecalho - 2):
+                    tamanho_parte = _tamanho(parte) + 2
+                    if tamanho_atual + tamanho_cabecalho + tamanho_corpo + tamanho_parte > self.limite:
+                        # Fecha a mensagem atual; o cabeçalho se repete na próxima
+                        if corpo:
+                            atual.append("\n\n".join([cabecalho] + corpo))
+                        if atual:
+                            mensagens.append("\n\n➖➖➖\n\n".join(atual))
+                        atual, tamanho_atual = [], 0
+                        corpo, tamanho_corpo = [], 0
+                    corpo.append(parte)
+                    tamanho_corpo += tamanho_parte
+            if corpo:
+                atual.append("\n\n".join([cabecalho] + corpo))
+                tamanho_atual += tamanho_cabecalho + tamanho_corpo + 9
+        if atual:
+            mensagens.append("\n\n➖➖➖\n\n".join(atual))
+        return mensagens
+
+    async def descarregar(self) -> None:
+        """
+        Envia ao administrador todos os textos pendentes, em ordem.
+        """
+        if self._tarefa is not None and self._tarefa is not asyncio.current_task():
+            self._tarefa.cancel()
+            self._tarefa = None
+        async with self._trava:
+            if not self._blocos:
+                return
+            blocos = list(self._blocos.values())
+            self._blocos = {}
+            self._tamanho = 0
+            for mensagem in self._montar(blocos):
+                try:
+                    await self._bot.send_message(chat_id=ADMIN_ID, text=mensagem, parse_mode="HTML")
+                except Exception as e:
+                    logger.error(f"Erro ao enviar resumo ao admin: {e}")
+
+# Usado para todos os textos com ADMIN_DIGEST=1, e para o excedente quando a fila do admin enche
+digesto_admin = DigestoAdmin()
+
+# ------------------------------
+# Persistência
+# ------------------------------
+# Campos que só fazem sentido em memória e nunca são salvos (o "albums" das versões
+# antigas, que guardava os álbuns em andamento no user_data)
+CAMPOS_TRANSITORIOS = frozenset({"albums"})
+
+def _sem_transitorios(dados):
+    """
+    Remove de um dict os campos transitórios.
+    """
+    if not isinstance(dados, dict):
+        return dados
+    return {chave: valor for chave, valor in dados.items() if chave not in CAMPOS_TRANSITORIOS}
+
+class _UnpicklerPersistencia(pickle.Unpickler):
+    """
+    Lê arquivos do PicklePersistence, que guardam o bot como referência persistente.
+    """
+    def persistent_load(self, pid):
+        return None
+
+class PersistenciaSQLite(BasePersistence):
+    """
+    Persistência em SQLite (modo WAL), gravando apenas as chaves alteradas.
+
+    - user_data e chat_data são carregados sob demanda, no primeiro update de cada usuário/chat;
+    - As alterações de um ciclo de `update_persistence` são gravadas numa única transação,
+      e dados idênticos aos já gravados são ignorados;
+    - Campos transitórios (ver `CAMPOS_TRANSITORIOS`) nunca são gravados;
+    - Tasks, futures e outros objetos que não podem ser copiados não devem ir para
+      user_data/chat_data/bot_data: a PTB faz deepcopy dos dados antes de chamar a
+      persistência, e o ciclo inteiro falha antes de eles chegarem aqui;
+    - bot_data e callback_data são gravados sob `chave_global`. Com vários workers, cada um
+      usa a sua (user_data e chat_data já são separados por chat), e nenhum sobrescreve o outro.
+    """
+
+    def __init__(
+        self, caminho: str, store_data=None, update_interval: float = 60, chave_global: str = ""
+    ) -> None:
+        super().__init__(store_data=store_data, update_interval=update_interval)
+        self.caminho = caminho
+        self.chave_global = chave_global
+        self._conexao = None
+        self._trava = threading.Lock()
+        self._carregados = {"user": set(), "chat": set()}
+        self._assinaturas: dict[tuple, int] = {}
+        self._pendentes: dict[tuple, bytes] = {}
+        self._gravacao = None
+
+    # --- Acesso ao banco (executado fora do loop, em uma thread) ---
+    def _conectar(self) -> sqlite3.Connection:
+        if self._conexao is None:
+            self._conexao = sqlite3.connect(self.caminho, check_same_thread=False, isolation_level=None)
+            self._conexao.execute("PRAGMA journal_mode=WAL")
+            self._conexao.execute("PRAGMA synchronous=NORMAL")
+            self._conexao.execute(
+                "CREATE TABLE IF NOT EXISTS dados ("
+                "tipo TEXT NOT NULL, chave TEXT NOT NULL, valor BLOB NOT NULL, "
+                "PRIMARY KEY (tipo, chave)) WITHOUT ROWID"
+            )
+        return self._conexao
+
+    def _ler(self, tipo: str, chave: str = None) -> list:
+        with self._trava:
+            conexao = self._conectar()
+            if chave is None:
+                return conexao.execute("SELECT chave, valor FROM dados WHERE tipo = ?", (tipo,)).fetchall()
+            return conexao.execute(
+                "SELECT chave, valor FROM dados WHERE tipo = ? AND chave = ?", (tipo, chave)
+            ).fetchall()
+
+    def _gravar(self, lote: dict) -> None:
+        with self._trava:
+            conexao = self._conectar()
+            conexao.execute("BEGIN")
+            try:
+                conexao.executemany(
+                    "INSERT OR REPLACE INTO dados (tipo, chave, valor) VALUES (?, ?, ?)",
+                    [(tipo, chave, valor) for (tipo, chave), valor in lote.items() if valor is not None]
+                )
+                conexao.executemany(
+                    "DELETE FROM dados WHERE tipo = ? AND chave = ?",
+                    [(tipo, chave) for (tipo, chave), valor in lote.items() if valor is None]
+                )
+                conexao.execute("COMMIT")
+            except Exception:
+                conexao.execute("ROLLBACK")
+                raise
+
+    async def _carregar(self, tipo: str, chave: str = ""):
+        linhas = await asyncio.to_thread(self._ler, tipo, chave)
+        return pickle.loads(linhas[0][1]) if linhas else None
+
+    # --- Gravação em lote ---
+    def _marcar(self, tipo: str, chave: str, dados) -> None:
+        """
+        Registra uma alteração pendente (`dados=None` remove a chave).
+        """
+        if dados is None:
+            valor = None
+            self._assinaturas.pop((tipo, chave), None)
+        else:
+            valor = pickle.dumps(_sem_transitorios(dados), protocol=pickle.HIGHEST_PROTOCOL)
+            assinatura = zlib.crc32(valor)
+            if self._assinaturas.get((tipo, chave)) == assinatura:
+                return
+            self._assinaturas[(tipo, chave)] = assinatura
+        self._pendentes[(tipo, chave)] = valor
+        if self._gravacao is None:
+            self._gravacao = asyncio.create_task(self._gravar_lote())
+
+    async def _gravar_lote(self) -> None:
+        try:
+            # Deixa as demais chamadas do mesmo ciclo entrarem no lote
+            await asyncio.sleep(0)
+            while self._pendentes:
+                lote, self._pendentes = self._pendentes, {}
+                try:
+                    await asyncio.to_thread(self._gravar, lote)
+                except Exception as e:
+                    logger.error(f"Erro ao gravar a persistência: {e}")
+                    for tipo_chave in lote:
+                        self._assinaturas.pop(tipo_chave, None)
+        finally:
+            self._gravacao = None
+
+    # --- Leitura ---
+    async def get_user_data(self) -> dict:
+        # Carregado sob demanda em refresh_user_data
+        return {}
+
+    async def get_chat_data(self) -> dict:
+        # Carregado sob demanda em refresh_chat_data
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return await self._carregar("bot", self.chave_global) or {}
+
+    async def get_callback_data(self):
+        return await self._carregar("callback", self.chave_global)
+
+    async def get_conversations(self, name: str) -> dict:
+        linhas = await asyncio.to_thread(self._ler, f"conversa:{name}")
+        return {tuple(json.loads(chave)): pickle.loads(valor) for chave, valor in linhas}
+
+    async def _refrescar(self, tipo: str, chave: int, dados: dict) -> None:
+        if chave in self._carregados[tipo]:
+            return
+        self._carregados[tipo].add(chave)
+        salvos = await self._carregar(tipo, str(chave))
+        if salvos:
+            for campo, valor in salvos.items():
+                dados.setdefault(campo, valor)
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        await self._refrescar("user", user_id, user_data)
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        await self._refrescar("chat", chat_id, chat_data)
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+    # --- Escrita ---
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        self._marcar("user", str(user_id), data)
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        self._marcar("chat", str(chat_id), data)
+
+    async def update_bot_data(self, data: dict) -> None:
+        self._marcar("bot", self.chave_global, data)
+
+    async def update_callback_data(self, data) -> None:
+        self._marcar("callback", self.chave_global, data)
+
+    async def update_conversation(self, name: str, key: tuple, new_state) -> None:
+        self._marcar(f"conversa:{name}", json.dumps(list(key)), new_state)
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._carregados["user"].discard(user_id)
+        self._marcar("user", str(user_id), None)
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        self._carregados["chat"].discard(chat_id)
+        self._marcar("chat", str(chat_id), None)
+
+    async def flush(self) -> None:
+        if self._gravacao is not None:
+            await self._gravacao
+        if self._pendentes:
+            await self._gravar_lote()
+        if self._conexao is not None:
+            with self._trava:
+                self._conexao.close()
+                self._conexao = None
+
+def importar_pickle(caminho_pickle: str, caminho_db: str) -> None:
+    """
+    Importa (uma única vez) os dados de um arquivo do PicklePersistence para o SQLite.
+    """
+    with open(caminho_pickle, "rb") as arquivo:
+        dados = _UnpicklerPersistencia(arquivo).load()
+
+    def blob(valor) -> bytes:
+        return pickle.dumps(_sem_transitorios(valor), protocol=pickle.HIGHEST_PROTOCOL)
+
+    lote = {}
+    for tipo in ("user", "chat"):
+        for chave, valor in (dados.get(f"{tipo}_data") or {}).items():
+            lote[(tipo, str(chave))] = blob(valor)
+    if dados.get("bot_data"):
+        lote[("bot", "")] = blob(dados["bot_data"])
+    if dados.get("callback_data") is not None:
+        lote[("callback", "")] = blob(dados["callback_data"])
+    for nome, conversa in (dados.get("conversations") or {}).items():
+        for chave, estado in conversa.items():
+            lote[(f"conversa:{nome}", json.dumps(list(chave)))] = blob(estado)
+
+    persistencia = PersistenciaSQLite(caminho_db)
+    persistencia._gravar(lote)
+    persistencia._conexao.close()
+    logger.info(f"{len(lote)} registros importados de {caminho_pickle} para {caminho_db}")
+
 # ------------------------------
 # Handlers de Mensagens
 # ------------------------------
@@ -103,6 +1412,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     )
     await update.message.reply_text(help_message, parse_mode="HTML")
 
+@medido
 async def receber_texto(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     Processa mensagens de texto, enviando uma cópia para o administrador e fazendo echo para o usuário.
@@ -113,6 +1423,15 @@ async def receber_texto(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         username = update.message.from_user.username or "N/A"
         mensagem = update.message.text
 
+        # Com a fila do admin cheia, o texto vai no resumo (e segue nele enquanto houver
+        # pendentes, para manter a ordem); nada é descartado
+        if ADMIN_DIGEST or len(digesto_admin) or fila_admin_cheia(context):
+            await update.message.reply_text(mensagem)
+            if not ADMIN_DIGEST:
+                metricas.admin_resumidos += 1
+            digesto_admin.adicionar(context.bot, user_id, user_name, username, safe_escape(mensagem))
+            return
+
         mensagem_info = (
             f"📩 <b>Nova mensagem recebida:</b>\n\n"
             f"🔹 <b>ID do Usuário:</b> <code>{user_id}</code>\n"
@@ -120,130 +1439,341 @@ async def receber_texto(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
             f"🔹 <b>Username:</b> @{username if username != 'N/A' else 'N/A'}\n\n"
             f"💬 <b>Mensagem:</b>\n{safe_escape(mensagem)}"
         )
-        await context.bot.send_message(chat_id=ADMIN_ID, text=mensagem_info, parse_mode="HTML")
         await update.message.reply_text(mensagem)
+        # O envio ao admin segue em segundo plano, na fila do chat do admin
+        agendar_envio_admin(enviar_ao_admin(context, user_id, text=mensagem_info, parse_mode="HTML"))
     except Exception as e:
         await notificar_erro(context, e, user_id=update.message.chat_id)
 
+@medido
 async def receber_midia(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     Processa mídias (foto, vídeo, GIF) e as agrupa para envio.
     """
     try:
-        user_id = update.message.chat_id
-        user_name = update.message.from_user.first_name or "N/A"
-        username = update.message.from_user.username or "N/A"
         caption = safe_escape(update.message.caption or "")
 
-        # Armazenamento do álbum do usuário
-        user_albums = context.user_data.setdefault("albums", {})
-        album = user_albums.setdefault(user_id, {
-            "media": [],
-            "original_captions": [],
-            "timer": None,
-            "user_info_sent": False
-        })
-
         # Processar mídia conforme o tipo
-        if update.message.photo:
-            media = InputMediaPhoto(media=update.message.photo[-1].file_id)
-            album["original_captions"].append(caption)
-        elif update.message.video:
-            media = InputMediaVideo(media=update.message.video.file_id)
-            album["original_captions"].append(caption)
-        elif update.message.animation:
-            # Processa GIF separadamente (sem agrupar)
-            await context.bot.send_animation(
-                chat_id=ADMIN_ID,
-                animation=update.message.animation.file_id,
-                caption=caption
-            )
-            await context.bot.send_animation(
-                chat_id=user_id,
-                animation=update.message.animation.file_id,
-                caption=None
-            )
-            return
+        message = update.message
+        if message.photo:
+            media = (message.message_id, "photo", message.photo[-1].file_id)
+        elif message.video:
+            media = (message.message_id, "video", message.video.file_id)
+        elif message.animation:
+            # GIFs nunca fazem parte de álbuns: o agregador os envia imediatamente
+            media = (message.message_id, "animation", message.animation.file_id)
         else:
             await update.message.reply_text("⚠️ Formato não suportado!")
             return
 
-        album["media"].append(media)
+        agregador_albuns.adicionar(update, context, media, caption)
+    except Exception as e:
+        await notificar_erro(context, e, user_id=update.message.chat_id)
+
+async def reenviar_midias(context: ContextTypes.DEFAULT_TYPE, chat_id: int, album: Album, com_legenda: bool) -> None:
+    """
+    Reenvia as mídias do álbum pelo file_id (usado quando não é possível copiar as mensagens).
+    """
+    grupo = []
+    for i, (_, tipo, file_id) in enumerate(album.media):
+        caption = album.original_captions[i] if com_legenda and i == 0 else None
+        if tipo == "animation":
+            await context.bot.send_animation(chat_id=chat_id, animation=file_id, caption=caption)
+        elif tipo == "photo":
+            grupo.append(InputMediaPhoto(media=file_id, caption=caption))
+        else:
+            grupo.append(InputMediaVideo(media=file_id, caption=caption))
 
-        # Cancelar timer anterior, se existir, para evitar envios duplicados
-        if album["timer"]:
-            album["timer"].cancel()
-        album["timer"] = asyncio.create_task(
-            enviar_album(user_id, user_name, username, album, context)
+    # Envia os grupos de mídia em chunks (máximo 10 por envio)
+    for chunk in [grupo[i:i+10] for i in range(0, len(grupo), 10)]:
+        await context.bot.send_media_group(chat_id=chat_id, media=chunk)
+
+async def repassar_midias(context: ContextTypes.DEFAULT_TYPE, chat_id: int, album: Album, remove_caption: bool) -> None:
+    """
+    Copia as mensagens do álbum para `chat_id` (até 100 por chamada, mantendo o agrupamento),
+    recorrendo ao reenvio por file_id apenas se a cópia for recusada.
+    """
+    if RELAY_COPIA:
+        # copy_messages exige os ids em ordem estritamente crescente
+        message_ids = sorted({message_id for message_id, _, _ in album.media})
+        try:
+            for i in range(0, len(message_ids), LOTE_COPIA):
+                await context.bot.copy_messages(
+                    chat_id=chat_id,
+                    from_chat_id=album.user_id,
+                    message_ids=message_ids[i:i+LOTE_COPIA],
+                    remove_caption=remove_caption
+                )
+            return
+        except BadRequest as e:
+            logger.warning(f"Não foi possível copiar as mídias para {chat_id} ({e}); reenviando")
+    await reenviar_midias(context, chat_id, album, com_legenda=not remove_caption)
+
+@medido
+async def enviar_album(album: Album) -> None:
+    """
+    Envia o álbum (agrupamento de mídias) para o administrador e para o usuário.
+    """
+    context = album.context
+    user_id = album.user_id
+    try:
+        async def enviar_admin() -> None:
+            # Textos anteriores do resumo chegam ao admin antes do álbum
+            await digesto_admin.descarregar()
+            # GIFs avulsos vão sem cabeçalho, como antes, para poupar a cota do chat do admin
+            if not (len(album.media) == 1 and album.media[0][1] == "animation"):
+                await enviar_info_usuario(user_id, album.user_name, album.username, context)
+            await repassar_midias(context, ADMIN_ID, album, remove_caption=False)
+
+        # O eco ao usuário (sem legendas) não espera a fila do admin
+        await asyncio.gather(
+            enviar_admin(),
+            repassar_midias(context, user_id, album, remove_caption=True),
         )
+
     except Exception as e:
-        await notificar_erro(context, e, user_id=update.message.chat_id)
+        await notificar_erro(context, e, user_id=user_id)
+
+agregador_albuns = AgregadorDeAlbuns(enviar_album)
+
+async def encerrar_pendentes(application: Application) -> None:
+    """
+    Avisa os usuários com updates ainda atrasados pelo controle de entrada e entrega
+    os álbuns, envios ao admin, resumos e erros pendentes antes de desligar o bot,
+    por no máximo ENCERRAMENTO_MAX segundos; o que não couber nesse prazo é registrado no log.
+    """
+    async def entregar() -> None:
+        await controle_entrada.encerrar(application.bot)
+        await agregador_albuns.encerrar()
+        if envios_admin:
+            await asyncio.gather(*envios_admin, return_exceptions=True)
+        await digesto_admin.descarregar()
+        await agregador_erros.descarregar()
+
+    try:
+        await asyncio.wait_for(entregar(), ENCERRAMENTO_MAX)
+    except asyncio.TimeoutError:
+        logger.error(
+            f"Desligamento: envios ao admin não concluídos em {ENCERRAMENTO_MAX:g} s; "
+            f"{len(envios_admin)} mensagens em segundo plano e {len(digesto_admin)} textos do resumo não foram entregues"
+        )
 
-async def enviar_album(user_id: int, user_name: str, username: str, album: dict, context: ContextTypes.DEFAULT_TYPE) -> None:
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
-    Aguarda um breve intervalo e envia o álbum (agrupamento de mídias) para o administrador e para o usuário.
+    Responde ao comando /stats (apenas para o administrador) com as métricas do bot.
     """
-    await asyncio.sleep(3)
-    if album["media"]:
+    await update.message.reply_text(metricas.resumo(), parse_mode="HTML")
+
+# ------------------------------
+# Webhook
+# ------------------------------
+def _chat_id_bruto(dados: dict):
+    """
+    Extrai o chat (ou usuário) de um update em JSON, sem desserializá-lo.
+    """
+    for valor in dados.values():
+        if not isinstance(valor, dict):
+            continue
+        chat = valor.get("chat") or (valor.get("message") or {}).get("chat")
+        if chat:
+            return chat.get("id")
+        usuario = valor.get("from") or valor.get("user")
+        if usuario:
+            return usuario.get("id")
+    return None
+
+def indice_worker(dados: dict, workers: int) -> int:
+    """
+    Escolhe o worker de um update pelo hash do chat_id, mantendo cada chat sempre no mesmo worker.
+    """
+    chat_id = _chat_id_bruto(dados)
+    if chat_id is None:
+        return 0
+    return zlib.crc32(str(chat_id).encode()) % workers
+
+def iniciar_worker(indice: int) -> subprocess.Popen:
+    """
+    Inicia um processo worker, com seu próprio webhook local.
+    """
+    env = dict(os.environ, WORKER_INDICE=str(indice))
+    return subprocess.Popen([sys.executable, os.path.abspath(__file__)], env=env)
+
+def iniciar_workers() -> list:
+    """
+    Inicia todos os processos worker.
+    """
+    return [iniciar_worker(indice) for indice in range(WEBHOOK_WORKERS)]
+
+async def supervisionar_workers(workers: list, parar: asyncio.Event) -> bool:
+    """
+    Reinicia os workers que terminarem. Se um worker cair mais de WORKER_MAX_REINICIOS
+    vezes em um minuto, desliga o receptor (e retorna False) em vez de responder 503
+    para sempre à sua fatia de chats.
+    """
+    reinicios = [deque() for _ in workers]
+    while not parar.is_set():
+        for indice, worker in enumerate(workers):
+            codigo = worker.poll()
+            if codigo is None:
+                continue
+            agora = time.monotonic()
+            historico = reinicios[indice]
+            while historico and historico[0] < agora - 60:
+                historico.popleft()
+            if len(historico) >= WORKER_MAX_REINICIOS:
+                logger.critical(f"Worker {indice} terminou {len(historico) + 1} vezes em 1 minuto; encerrando")
+                parar.set()
+                return False
+            historico.append(agora)
+            logger.error(f"Worker {indice} terminou (código {codigo}); reiniciando")
+            workers[indice] = iniciar_worker(indice)
         try:
-            admin_media = []
-            user_media = []
-            
-            for i, media in enumerate(album["media"]):
-                admin_caption = album["original_captions"][i] if i == 0 else None
-                if isinstance(media, InputMediaPhoto):
-                    admin_media.append(InputMediaPhoto(
-                        media=media.media,
-                        caption=admin_caption
-                    ))
-                    user_media.append(InputMediaPhoto(media=media.media))
-                else:
-                    admin_media.append(InputMediaVideo(
-                        media=media.media,
-                        caption=admin_caption
-                    ))
-                    user_media.append(InputMediaVideo(media=media.media))
-                    
-            # Enviar informações do usuário (apenas uma vez)
-            if not album["user_info_sent"]:
-                await enviar_info_usuario(user_id, user_name, username, context)
-                album["user_info_sent"] = True
-
-            # Envia os grupos de mídia em chunks (máximo 10 por envio)
-            for chunk in [admin_media[i:i+10] for i in range(0, len(admin_media), 10)]:
-                await context.bot.send_media_group(chat_id=ADMIN_ID, media=chunk)
-            for chunk in [user_media[i:i+10] for i in range(0, len(user_media), 10)]:
-                await context.bot.send_media_group(chat_id=user_id, media=chunk)
+            await asyncio.wait_for(parar.wait(), 1)
+        except asyncio.TimeoutError:
+            pass
+    return True
 
-        except Exception as e:
-            await notificar_erro(context, e, user_id=user_id)
-        finally:
-            album["media"].clear()
-            album["original_captions"].clear()
-            album["user_info_sent"] = False
+async def executar_receptor(workers: list) -> bool:
+    """
+    Recebe os updates do Telegram e os repassa ao worker responsável pelo chat.
+    Retorna False se o receptor parou porque um worker não se manteve de pé.
+    """
+    import signal
+    from tornado.httpserver import HTTPServer
+    from tornado.web import Application as TornadoApplication, RequestHandler
+
+    cliente = httpx.AsyncClient(limits=httpx.Limits(max_keepalive_connections=4 * WEBHOOK_WORKERS))
+    destinos = [
+        f"http://127.0.0.1:{WORKER_PORTA_BASE + indice}/{WEBHOOK_PATH}"
+        for indice in range(WEBHOOK_WORKERS)
+    ]
+
+    class EncaminharUpdate(RequestHandler):
+        async def post(self) -> None:
+            segredo = self.request.headers.get("X-Telegram-Bot-Api-Secret-Token")
+            if WEBHOOK_SECRET and segredo != WEBHOOK_SECRET:
+                self.set_status(403)
+                return
+            try:
+                dados = json.loads(self.request.body)
+            except ValueError:
+                self.set_status(400)
+                return
+            headers = {"Content-Type": "application/json"}
+            if segredo:
+                headers["X-Telegram-Bot-Api-Secret-Token"] = segredo
+            try:
+                resposta = await cliente.post(
+                    destinos[indice_worker(dados, WEBHOOK_WORKERS)],
+                    content=self.request.body,
+                    headers=headers
+                )
+                self.set_status(resposta.status_code)
+            except httpx.HTTPError as e:
+                # O Telegram reenvia o update se não recebermos com sucesso
+                logger.error(f"Erro ao repassar update ao worker: {e}")
+                self.set_status(503)
+
+    servidor = HTTPServer(TornadoApplication([(rf"/{WEBHOOK_PATH}/?", EncaminharUpdate)]))
+    servidor.listen(PORT)
+    logger.info(f"Receptor ouvindo na porta {PORT} com {WEBHOOK_WORKERS} workers")
+
+    parar = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sinal in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sinal, parar.set)
+    supervisor = asyncio.create_task(supervisionar_workers(workers, parar))
+    try:
+        await parar.wait()
+    finally:
+        servidor.stop()
+        workers_ok = await supervisor
+        await cliente.aclose()
+    return workers_ok
 
 # ------------------------------
 # Função Principal
 # ------------------------------
-def main() -> None:
+def criar_aplicacao(request: BaseRequest = None) -> Application:
     """
-    Configuração e inicialização do bot.
+    Cria a aplicação com os handlers registrados.
+    `request` substitui o cliente HTTP (usado pelo benchmark com a API falsa).
     """
-    logger.info("🤖 Bot Anônimo Iniciado")
-    app = Application.builder().token(BOT_TOKEN).build()
+    builder = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .rate_limiter(LimitadorDeEnvio())
+        .concurrent_updates(ProcessadorPorUsuario())
+        .post_init(iniciar_metricas)
+        .post_stop(encerrar_pendentes)
+        .post_shutdown(parar_metricas)
+    )
+    if TELEGRAM_BASE_URL:
+        builder = builder.base_url(TELEGRAM_BASE_URL).base_file_url(TELEGRAM_BASE_URL)
+    if request is not None:
+        builder = builder.request(request).get_updates_request(request)
+    if PERSISTENCIA_DB:
+        # O worker 0 mantém a chave do modo com um único processo
+        chave_global = f"worker:{WORKER_INDICE}" if WORKER_INDICE not in (None, "0") else ""
+        builder = builder.persistence(PersistenciaSQLite(PERSISTENCIA_DB, chave_global=chave_global))
+    app = builder.build()
+
+    # Controle de entrada antes de qualquer handler
+    app.add_handler(TypeHandler(Update, controle_entrada.controlar), group=-1)
 
     # Registrando handlers
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("help", help_command))
+    app.add_handler(CommandHandler("stats", stats, filters=filters.User(user_id=ADMIN_ID)))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, receber_texto))
     app.add_handler(MessageHandler(
         filters.PHOTO | filters.VIDEO | filters.ANIMATION,
         receber_midia
     ))
     app.add_error_handler(error_handler)
+    return app
 
-    # Inicia o polling
-    app.run_polling()
+def main() -> None:
+    """
+    Configuração e inicialização do bot.
+    """
+    if MODO != "webhook":
+        logger.info("🤖 Bot Anônimo Iniciado")
+        # Inicia o polling
+        criar_aplicacao().run_polling()
+        return
+
+    if WEBHOOK_WORKERS > 1 and WORKER_INDICE is None:
+        # Processo receptor: distribui os updates entre os workers
+        workers = iniciar_workers()
+        try:
+            workers_ok = asyncio.run(executar_receptor(workers))
+        finally:
+            for worker in workers:
+                worker.terminate()
+            for worker in workers:
+                worker.wait()
+        if not workers_ok:
+            sys.exit(1)
+        return
+
+    if WORKER_INDICE is None:
+        listen, port = "0.0.0.0", PORT
+    else:
+        listen, port = "127.0.0.1", WORKER_PORTA_BASE + int(WORKER_INDICE)
+    logger.info(f"🤖 Bot Anônimo Iniciado (webhook em {listen}:{port})")
+    # Todos os workers registram a mesma URL pública; o setWebhook repetido é idempotente
+    criar_aplicacao().run_webhook(
+        listen=listen,
+        port=port,
+        url_path=WEBHOOK_PATH,
+        webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+        secret_token=WEBHOOK_SECRET
+    )
 
 if __name__ == "__main__":
-    main()
+    if sys.argv[1:2] == ["importar-pickle"]:
+        # python app.py importar-pickle bot_data.pickle [bot_data.db]
+        importar_pickle(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else PERSISTENCIA_DB or "bot_data.db")
+    else:
+        main()
@@ -0,0 +1,253 @@
+"""
+Benchmark offline do bot contra a Bot API falsa (fake_telegram.py).
+
+Uso:
+    python benchmark.py                                   # todos os cenários
+    python benchmark.py --cenarios texto album --usuarios 50 --eventos 500
+    python benchmark.py --latencia 0.05 --taxa-429 0.01   # API lenta e com 429
+    python benchmark.py --trace trace.jsonl               # reproduz um trace
+    python benchmark.py --gerar-trace > trace.jsonl       # gera um trace sintético
+    python benchmark.py --saida atual.json --comparar anterior.json
+
+Cada cenário roda em um processo próprio (para medir o pico de RSS isoladamente) e
+reporta vazão, latência de repasse p50/p99 (do update até o eco ao usuário), chamadas
+à API por update e pico de RSS. O resultado é salvo em JSON para comparar execuções.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from collections import Counter
+
+ADMIN_ID = 999
+
+# Cenário -> (tipos de evento, handler exercitado)
+CENARIOS = {
+    "texto": (["texto"], "receber_texto"),
+    "foto": (["foto"], "receber_midia"),
+    "gif": (["gif"], "receber_midia"),
+    "album": (["album"], "enviar_album"),
+    "misto": (["texto", "foto", "album", "texto", "gif"], "todos"),
+}
+
+def _percentil(valores: list, p: float) -> float:
+    if not valores:
+        return 0.0
+    return valores[min(len(valores) - 1, int(round(p / 100 * (len(valores) - 1))))]
+
+async def _executar(args, trace: list) -> dict:
+    """
+    Roda um trace no bot em processo, com a API falsa como cliente HTTP.
+    """
+    import app
+    from fake_telegram import ApiFalsa, RequisicaoFalsa, updates_do_evento
+    from telegram import Update
+
+    logging.getLogger().setLevel(logging.WARNING)
+    api = ApiFalsa(args.latencia, args.variacao, args.taxa_429, args.retry_after, semente=args.semente)
+    aplicacao = app.criar_aplicacao(request=RequisicaoFalsa(api))
+
+    # Expande os eventos em updates, mantendo o instante de cada um
+    agenda = [(evento.get("t", 0), dados) for evento in trace for dados in updates_do_evento(evento)]
+    esperados = {}
+    for _, dados in agenda:
+        mensagem = dados["message"]
+        chave = ("texto", mensagem["chat"]["id"], mensagem["text"]) if "text" in mensagem else mensagem["message_id"]
+        esperados[chave] = None
+
+    def entregues() -> int:
+        total = 0
+        for _, metodo, params in api.chamadas:
+            if params.get("chat_id") == ADMIN_ID:
+                continue
+            if metodo == "sendMessage":
+                total += 1
+            elif metodo == "copyMessages":
+                total += len(params["message_ids"])
+        return total
+
+    await aplicacao.initialize()
+    await aplicacao.start()
+    chamadas_iniciais = len(api.chamadas)
+    inicio = time.monotonic()
+    for instante, dados in agenda:
+        if args.tempo_real and instante > time.monotonic() - inicio:
+            await asyncio.sleep(instante - (time.monotonic() - inicio))
+        esperados[
+            ("texto", dados["message"]["chat"]["id"], dados["message"]["text"])
+            if "text" in dados["message"] else dados["message"]["message_id"]
+        ] = time.monotonic()
+        await aplicacao.update_queue.put(Update.de_json(dados, aplicacao.bot))
+
+    limite = time.monotonic() + args.timeout
+    while entregues() < len(esperados) and time.monotonic() < limite:
+        await asyncio.sleep(0.01)
+    fim = time.monotonic()
+    await aplicacao.stop()
+    await aplicacao.shutdown()
+
+    # Latência: do update até a primeira chamada que entrega o eco ao usuário
+    latencias = []
+    vistos = set()
+    for instante, metodo, params in api.chamadas[chamadas_iniciais:]:
+        if params.get("chat_id") == ADMIN_ID:
+            continue
+        if metodo == "sendMessage":
+            chaves = [("texto", params["chat_id"], params["text"])]
+        elif metodo == "copyMessages":
+            chaves = params["message_ids"]
+        else:
+            continue
+        for chave in chaves:
+            if esperados.get(chave) is not None and chave not in vistos:
+                vistos.add(chave)
+                latencias.append(instante - esperados[chave])
+    latencias.sort()
+
+    chamadas = Counter(metodo for _, metodo, _ in api.chamadas[chamadas_iniciais:])
+    total_chamadas = sum(chamadas.values()) + sum(api.respostas_429.values())
+    duracao = fim - inicio
+    return {
+        "updates": len(agenda),
+        "entregues": len(vistos),
+        "duracao_s": round(duracao, 4),
+        "vazao_updates_s": round(len(vistos) / duracao, 2) if duracao else 0.0,
+        "latencia_p50_ms": round(_percentil(latencias, 50) * 1000, 2),
+        "latencia_p99_ms": round(_percentil(latencias, 99) * 1000, 2),
+        "latencia_max_ms": round(latencias[-1] * 1000, 2) if latencias else 0.0,
+        "chamadas_api_por_update": round(total_chamadas / len(agenda), 3) if agenda else 0.0,
+        "chamadas_api": dict(chamadas),
+        "respostas_429": sum(api.respostas_429.values()),
+        # ru_maxrss é em KB no Linux
+        "pico_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+def _ambiente(args) -> dict:
+    env = dict(os.environ, BOT_TOKEN="123456:falso", ADMIN_ID=str(ADMIN_ID))
+    if not args.limites_reais:
+        # Sem os limites do Telegram, o benchmark mede o custo do próprio bot
+        env.update(
+            MSGS_POR_SEGUNDO="1000000", MSGS_POR_CHAT_SEGUNDO="1000000", ADMIN_MSGS_POR_MINUTO="60000000",
+            ENTRADA_POR_MINUTO="60000000", ENTRADA_RAJADA="1000000",
+        )
+    return env
+
+def _repassar_opcoes(args) -> list:
+    opcoes = [
+        "--usuarios", str(args.usuarios), "--eventos", str(args.eventos),
+        "--intervalo", str(args.intervalo), "--itens", str(args.itens),
+        "--latencia", str(args.latencia), "--variacao", str(args.variacao),
+        "--taxa-429", str(args.taxa_429), "--retry-after", str(args.retry_after),
+        "--timeout", str(args.timeout), "--semente", str(args.semente),
+    ]
+    if args.tempo_real:
+        opcoes.append("--tempo-real")
+    if args.trace:
+        opcoes += ["--trace", args.trace]
+    return opcoes
+
+def executar_cenarios(args) -> dict:
+    """
+    Roda cada cenário em um subprocesso e junta os resultados.
+    """
+    nomes = ["trace"] if args.trace else args.cenarios
+    resultados = {}
+    for nome in nomes:
+        comando = [sys.executable, os.path.abspath(__file__), "--executar", nome] + _repassar_opcoes(args)
+        processo = subprocess.run(comando, env=_ambiente(args), capture_output=True, text=True)
+        if processo.returncode != 0:
+            print(processo.stderr, file=sys.stderr)
+            raise SystemExit(f"Cenário {nome} falhou")
+        resultado = json.loads(processo.stdout.strip().splitlines()[-1])
+        resultado["handler"] = CENARIOS[nome][1] if nome in CENARIOS else "todos"
+        resultados[nome] = resultado
+    return {
+        "data": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("saida", "comparar", "executar", "gerar_trace")},
+        "cenarios": resultados,
+    }
+
+METRICAS = [
+    ("vazao_updates_s", "updates/s", True),
+    ("latencia_p50_ms", "p50 ms", False),
+    ("latencia_p99_ms", "p99 ms", False),
+    ("chamadas_api_por_update", "API/update", False),
+    ("pico_rss_mb", "RSS MB", False),
+]
+
+def imprimir(resultado: dict, anterior: dict = None) -> None:
+    """
+    Tabela legível; com `anterior`, mostra a variação de cada métrica.
+    """
+    print(f"{'cenário':<8} {'handler':<14}" + "".join(f"{titulo:>18}" for _, titulo, _ in METRICAS))
+    for nome, cenario in resultado["cenarios"].items():
+        linha = f"{nome:<8} {cenario['handler']:<14}"
+        base = (anterior or {}).get("cenarios", {}).get(nome)
+        for chave, _, maior_melhor in METRICAS:
+            valor = cenario[chave]
+            celula = f"{valor:g}"
+            if base and base.get(chave):
+                delta = (valor - base[chave]) / base[chave] * 100
+                piorou = delta < 0 if maior_melhor else delta > 0
+                celula += f" ({delta:+.0f}%{'!' if piorou and abs(delta) >= 10 else ''})"
+            linha += f"{celula:>18}"
+        print(linha)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark offline do bot")
+    parser.add_argument("--cenarios", nargs="+", choices=sorted(CENARIOS), default=list(CENARIOS))
+    parser.add_argument("--trace", help="arquivo JSONL com eventos a reproduzir")
+    parser.add_argument("--usuarios", type=int, default=20)
+    parser.add_argument("--eventos", type=int, default=200)
+    parser.add_argument("--intervalo", type=float, default=0.0, help="segundos entre eventos do trace gerado")
+    parser.add_argument("--itens", type=int, default=4, help="itens por álbum")
+    parser.add_argument("--tempo-real", action="store_true", help="respeita os instantes do trace")
+    parser.add_argument("--latencia", type=float, default=0.0)
+    parser.add_argument("--variacao", type=float, default=0.0)
+    parser.add_argument("--taxa-429", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--limites-reais", action="store_true", help="mantém os limites de envio do Telegram")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--saida", help="grava o resultado em JSON")
+    parser.add_argument("--comparar", help="JSON de uma execução anterior")
+    parser.add_argument("--gerar-trace", action="store_true", help="imprime um trace sintético em JSONL")
+    parser.add_argument("--executar", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    from fake_telegram import gerar_trace, ler_trace
+
+    if args.gerar_trace:
+        tipos = [tipo for nome in args.cenarios for tipo in CENARIOS[nome][0]]
+        for evento in gerar_trace(tipos, args.usuarios, args.eventos, args.intervalo, args.itens):
+            print(json.dumps(evento))
+        return
+
+    if args.executar:
+        if args.trace:
+            trace = ler_trace(args.trace)
+        else:
+            tipos = CENARIOS[args.executar][0]
+            trace = gerar_trace(tipos, args.usuarios, args.eventos, args.intervalo, args.itens)
+        print(json.dumps(asyncio.run(_executar(args, trace))))
+        return
+
+    resultado = executar_cenarios(args)
+    anterior = None
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as arquivo:
+            anterior = json.load(arquivo)
+    imprimir(resultado, anterior)
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as arquivo:
+            json.dump(resultado, arquivo, indent=2, ensure_ascii=False)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,425 @@
+"""
+Servidor falso da Bot API do Telegram, para testar o bot sem acesso à internet.
+
+Uso:
+    python fake_telegram.py                       # webhook com 2 workers
+    python fake_telegram.py --workers 4 --usuarios 20 --mensagens 10
+    python fake_telegram.py --polling             # bot em modo polling (getUpdates)
+    python fake_telegram.py --apenas-servidor     # só o servidor, para uso manual
+    python fake_telegram.py --latencia 0.05 --taxa-429 0.02
+
+O harness inicia o app.py apontando para este servidor (TELEGRAM_BASE_URL), envia
+updates sintéticos e confere se cada usuário recebeu o eco de todas as mensagens, em ordem,
+e se todos os textos e mídias foram repassados ao admin.
+
+A mesma API também pode ser usada no próprio processo, sem HTTP, via `RequisicaoFalsa`
+(é o que o benchmark.py faz), e pode simular latência e respostas 429.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import Counter, defaultdict
+
+import httpx
+from telegram.request import BaseRequest
+
+logger = logging.getLogger("fake_telegram")
+
+ADMIN_ID = 999
+BOT_TOKEN = "123456:falso"
+
+# ------------------------------
+# Geração de Updates
+# ------------------------------
+_ids = itertools.count(1)
+
+def _mensagem(chat_id: int, **campos) -> dict:
+    mensagem = {
+        "message_id": next(_ids),
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private", "first_name": f"Usuário {chat_id}"},
+        "from": {"id": chat_id, "is_bot": False, "first_name": f"Usuário {chat_id}", "username": f"u{chat_id}"},
+    }
+    mensagem.update(campos)
+    return {"update_id": next(_ids), "message": mensagem}
+
+def update_texto(chat_id: int, texto: str) -> dict:
+    return _mensagem(chat_id, text=texto)
+
+def update_foto(chat_id: int, media_group_id: str = None, caption: str = None) -> dict:
+    file_id = f"foto-{next(_ids)}"
+    campos = {"photo": [{"file_id": file_id, "file_unique_id": file_id, "width": 800, "height": 600}]}
+    if media_group_id:
+        campos["media_group_id"] = media_group_id
+    if caption:
+        campos["caption"] = caption
+    return _mensagem(chat_id, **campos)
+
+def update_video(chat_id: int, media_group_id: str = None) -> dict:
+    file_id = f"video-{next(_ids)}"
+    campos = {"video": {"file_id": file_id, "file_unique_id": file_id, "width": 640, "height": 480, "duration": 5}}
+    if media_group_id:
+        campos["media_group_id"] = media_group_id
+    return _mensagem(chat_id, **campos)
+
+def update_gif(chat_id: int) -> dict:
+    file_id = f"gif-{next(_ids)}"
+    animacao = {"file_id": file_id, "file_unique_id": file_id, "width": 320, "height": 240, "duration": 2}
+    return _mensagem(chat_id, animation=animacao, document=dict(animacao))
+
+def updates_album(chat_id: int, itens: int) -> list:
+    media_group_id = f"album-{next(_ids)}"
+    return [
+        update_foto(chat_id, media_group_id, caption="legenda" if i == 0 else None) if i % 2 == 0
+        else update_video(chat_id, media_group_id)
+        for i in range(itens)
+    ]
+
+def updates_do_evento(evento: dict) -> list:
+    """
+    Converte um evento de trace em updates. Formato (uma linha JSON por evento):
+    {"t": 0.5, "tipo": "texto" | "foto" | "video" | "gif" | "album", "chat_id": 1, "texto": "...", "itens": 3}
+    """
+    chat_id = evento["chat_id"]
+    tipo = evento["tipo"]
+    if tipo == "texto":
+        return [update_texto(chat_id, evento.get("texto") or f"mensagem {next(_ids)}")]
+    if tipo == "foto":
+        return [update_foto(chat_id)]
+    if tipo == "video":
+        return [update_video(chat_id)]
+    if tipo == "gif":
+        return [update_gif(chat_id)]
+    if tipo == "album":
+        return updates_album(chat_id, evento.get("itens", 3))
+    raise ValueError(f"Tipo de evento desconhecido: {tipo}")
+
+def gerar_trace(tipos: list, usuarios: int, eventos: int, intervalo: float = 0.0, itens: int = 3) -> list:
+    """
+    Gera um trace sintético: `eventos` eventos dos `tipos` dados, distribuídos entre os usuários.
+    """
+    trace = []
+    for i in range(eventos):
+        evento = {"t": round(i * intervalo, 6), "tipo": tipos[i % len(tipos)], "chat_id": 1 + i % usuarios}
+        if evento["tipo"] == "album":
+            evento["itens"] = itens
+        trace.append(evento)
+    return trace
+
+def ler_trace(caminho: str) -> list:
+    """
+    Lê um trace em JSONL, ignorando linhas vazias.
+    """
+    with open(caminho, encoding="utf-8") as arquivo:
+        return [json.loads(linha) for linha in arquivo if linha.strip()]
+
+# ------------------------------
+# Bot API Falsa
+# ------------------------------
+def _valor(bruto: str):
+    """
+    Os parâmetros chegam como formulário; valores complexos vêm em JSON.
+    """
+    try:
+        return json.loads(bruto)
+    except ValueError:
+        return bruto
+
+class ApiFalsa:
+    """
+    Responde às chamadas da Bot API e registra cada uma em `chamadas`
+    como (instante, método, parâmetros).
+
+    `latencia` (+ até `variacao` aleatória) atrasa cada resposta, e `taxa_429` é a
+    probabilidade de um envio ser recusado com 429 e `retry_after` segundos.
+    """
+
+    def __init__(
+        self,
+        latencia: float = 0.0,
+        variacao: float = 0.0,
+        taxa_429: float = 0.0,
+        retry_after: int = 1,
+        semente: int = None,
+    ) -> None:
+        self.latencia = latencia
+        self.variacao = variacao
+        self.taxa_429 = taxa_429
+        self.retry_after = retry_after
+        self.respostas_429 = Counter()
+        self._aleatorio = random.Random(semente)
+        self.chamadas = []
+        self._updates = []
+        self._novos_updates = asyncio.Event()
+        self._message_ids = itertools.count(1)
+
+    def enfileirar(self, update: dict) -> None:
+        """
+        Disponibiliza um update para o getUpdates (modo polling).
+        """
+        self._updates.append(update)
+        self._novos_updates.set()
+
+    def _mensagem_enviada(self, chat_id, **campos) -> dict:
+        mensagem = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id), "type": "private"},
+        }
+        mensagem.update(campos)
+        return mensagem
+
+    async def _get_updates(self, params: dict) -> list:
+        offset = int(params.get("offset") or 0)
+        self._updates = [u for u in self._updates if u["update_id"] >= offset]
+        if not self._updates:
+            self._novos_updates.clear()
+            try:
+                # Long polling curto, para o bot encerrar rápido
+                await asyncio.wait_for(self._novos_updates.wait(), min(float(params.get("timeout") or 0), 1))
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:int(params.get("limit") or 100)]
+
+    async def responder(self, metodo: str, params: dict) -> tuple:
+        """
+        Processa uma chamada e retorna (status HTTP, corpo JSON).
+        """
+        if metodo == "getUpdates":
+            return 200, {"ok": True, "result": await self._get_updates(params)}
+
+        if self.latencia or self.variacao:
+            await asyncio.sleep(self.latencia + self._aleatorio.random() * self.variacao)
+        if self.taxa_429 and metodo.startswith(("send", "copy")) and self._aleatorio.random() < self.taxa_429:
+            self.respostas_429[metodo] += 1
+            return 429, {
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }
+
+        self.chamadas.append((time.monotonic(), metodo, params))
+        chat_id = params.get("chat_id", 0)
+        if metodo == "getMe":
+            resultado = {"id": 123456, "is_bot": True, "first_name": "Bot Falso", "username": "bot_falso"}
+        elif metodo == "sendMessage":
+            resultado = self._mensagem_enviada(chat_id, text=params.get("text", ""))
+        elif metodo == "sendMediaGroup":
+            resultado = [self._mensagem_enviada(chat_id) for _ in params.get("media", [])]
+        elif metodo == "copyMessages":
+            resultado = [{"message_id": next(self._message_ids)} for _ in params.get("message_ids", [])]
+        elif metodo == "copyMessage":
+            resultado = {"message_id": next(self._message_ids)}
+        elif metodo.startswith("send"):
+            resultado = self._mensagem_enviada(chat_id)
+        else:
+            resultado = True
+        return 200, {"ok": True, "result": resultado}
+
+    def contar(self, metodo: str = None) -> Counter:
+        """
+        Número de chamadas por método (ou, com `metodo`, por chat_id).
+        """
+        if metodo is None:
+            return Counter(m for _, m, _ in self.chamadas)
+        return Counter(p.get("chat_id") for _, m, p in self.chamadas if m == metodo)
+
+class RequisicaoFalsa(BaseRequest):
+    """
+    Substitui o cliente HTTP do bot, respondendo pela `ApiFalsa` no mesmo processo.
+    """
+
+    def __init__(self, api: ApiFalsa) -> None:
+        self.api = api
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None) -> tuple:
+        params = dict(request_data.parameters) if request_data else {}
+        status, corpo = await self.api.responder(url.rsplit("/", 1)[-1], params)
+        return status, json.dumps(corpo).encode()
+
+async def iniciar_servidor(api: ApiFalsa, porta: int):
+    """
+    Sobe a API falsa em http://127.0.0.1:<porta>/bot<token>/<método>.
+    """
+    from tornado.httpserver import HTTPServer
+    from tornado.web import Application, RequestHandler
+
+    class Metodo(RequestHandler):
+        async def post(self, token: str, metodo: str) -> None:
+            if self.request.headers.get("Content-Type", "").startswith("application/json"):
+                params = json.loads(self.request.body or b"{}")
+            else:
+                params = {k: _valor(v[0].decode()) for k, v in self.request.body_arguments.items()}
+            try:
+                status, corpo = await api.responder(metodo, params)
+            except asyncio.CancelledError:
+                # Long polling pendente quando o harness encerra
+                return
+            self.set_status(status)
+            self.set_header("Content-Type", "application/json")
+            self.finish(json.dumps(corpo))
+
+        get = post
+
+    servidor = HTTPServer(Application([(r"/bot([^/]+)/(\w+)", Metodo)]))
+    servidor.listen(porta, "127.0.0.1")
+    return servidor
+
+# ------------------------------
+# Harness
+# ------------------------------
+async def _aguardar(condicao, timeout: float) -> bool:
+    limite = time.monotonic() + timeout
+    while time.monotonic() < limite:
+        if condicao():
+            return True
+        await asyncio.sleep(0.1)
+    return condicao()
+
+def _iniciar_bot(args, porta_api: int) -> subprocess.Popen:
+    env = dict(
+        os.environ,
+        BOT_TOKEN=BOT_TOKEN,
+        ADMIN_ID=str(ADMIN_ID),
+        TELEGRAM_BASE_URL=f"http://127.0.0.1:{porta_api}/bot",
+        # Limites altos: o harness testa o repasse, não o controle de envio
+        MSGS_POR_SEGUNDO="10000",
+        MSGS_POR_CHAT_SEGUNDO="10000",
+        ADMIN_MSGS_POR_MINUTO="600000",
+        ENTRADA_POR_MINUTO="600000",
+        ENTRADA_RAJADA="100000",
+    )
+    if args.polling:
+        env.update(MODO="polling")
+    else:
+        env.update(
+            MODO="webhook",
+            WEBHOOK_URL=f"http://127.0.0.1:{args.porta_webhook}",
+            WEBHOOK_SECRET="segredo-falso",
+            WEBHOOK_WORKERS=str(args.workers),
+            PORT=str(args.porta_webhook),
+            WORKER_PORTA_BASE=str(args.porta_webhook + 1),
+        )
+    app_py = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+    return subprocess.Popen([sys.executable, app_py], env=env)
+
+async def executar_harness(args) -> bool:
+    api = ApiFalsa(latencia=args.latencia, taxa_429=args.taxa_429)
+    servidor = await iniciar_servidor(api, args.porta)
+    if args.apenas_servidor:
+        logger.info(f"API falsa em http://127.0.0.1:{args.porta}/bot")
+        await asyncio.Event().wait()
+
+    bot = _iniciar_bot(args, args.porta)
+    try:
+        # Cada worker (ou o bot em polling) chama getMe ao iniciar
+        esperados = 1 if args.polling else args.workers
+        if not await _aguardar(lambda: api.contar()["getMe"] >= esperados, 30):
+            logger.error("O bot não iniciou a tempo")
+            return False
+        await asyncio.sleep(0.5)
+
+        enviados = defaultdict(list)
+        updates = []
+        for i in range(args.mensagens):
+            for chat_id in range(1, args.usuarios + 1):
+                texto = f"msg {i} de {chat_id}"
+                enviados[chat_id].append(texto)
+                updates.append(update_texto(chat_id, texto))
+        for chat_id in range(1, args.usuarios + 1):
+            updates.extend(updates_album(chat_id, 3))
+            updates.append(update_gif(chat_id))
+
+        if args.polling:
+            for update in updates:
+                api.enfileirar(update)
+        else:
+            url = f"http://127.0.0.1:{args.porta_webhook}/telegram"
+            async with httpx.AsyncClient() as cliente:
+                for update in updates:
+                    resposta = await cliente.post(
+                        url, json=update, headers={"X-Telegram-Bot-Api-Secret-Token": "segredo-falso"}
+                    )
+                    resposta.raise_for_status()
+
+        def ecos() -> dict:
+            recebidos = defaultdict(list)
+            for _, metodo, params in api.chamadas:
+                if metodo == "sendMessage" and params.get("chat_id") != ADMIN_ID:
+                    recebidos[params["chat_id"]].append(params["text"])
+            return recebidos
+
+        def copias_usuario() -> int:
+            return sum(1 for _, m, p in api.chamadas if m == "copyMessages" and p.get("chat_id") != ADMIN_ID)
+
+        # O admin é o destino do repasse: cada texto (avulso ou num resumo) e cada mídia têm de chegar a ele
+        midias = {u["message"]["message_id"] for u in updates if "text" not in u["message"]}
+
+        def faltando_admin() -> tuple:
+            textos, copiadas = [], set()
+            for _, metodo, params in api.chamadas:
+                if params.get("chat_id") != ADMIN_ID:
+                    continue
+                if metodo == "sendMessage":
+                    textos.append(params["text"])
+                elif metodo == "copyMessages":
+                    copiadas.update(params["message_ids"])
+            recebidos = "\n".join(textos) + "\n"
+            sem_texto = [t for lista in enviados.values() for t in lista if f"{t}\n" not in recebidos]
+            return sem_texto, midias - copiadas
+
+        def completo() -> bool:
+            return ecos() == enviados and copias_usuario() >= 2 * args.usuarios and faltando_admin() == ([], set())
+
+        ok = await _aguardar(completo, args.timeout)
+        logger.info(f"Chamadas por método: {dict(api.contar())}")
+        if ok:
+            logger.info(f"OK: {len(updates)} updates repassados para {args.usuarios} usuários, em ordem")
+        else:
+            sem_texto, sem_midia = faltando_admin()
+            logger.error(
+                f"Falha: ecos ausentes ou fora de ordem, ou repasses ao admin faltando "
+                f"({len(sem_texto)} textos e {len(sem_midia)} mídias)"
+            )
+        return ok
+    finally:
+        bot.terminate()
+        # Espera sem bloquear o loop: a API falsa precisa responder durante o encerramento
+        await asyncio.to_thread(bot.wait)
+        servidor.stop()
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Bot API falsa e harness de teste offline")
+    parser.add_argument("--porta", type=int, default=8081, help="porta da API falsa")
+    parser.add_argument("--porta-webhook", type=int, default=8443, help="porta do receptor do bot")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--usuarios", type=int, default=5)
+    parser.add_argument("--mensagens", type=int, default=10, help="textos por usuário")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--latencia", type=float, default=0.0, help="atraso (s) de cada resposta da API")
+    parser.add_argument("--taxa-429", type=float, default=0.0, help="fração de envios recusados com 429")
+    parser.add_argument("--polling", action="store_true", help="testa o bot em modo polling")
+    parser.add_argument("--apenas-servidor", action="store_true", help="só sobe a API falsa")
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    logging.getLogger("tornado.access").setLevel(logging.WARNING)
+    sys.exit(0 if asyncio.run(executar_harness(args)) else 1)
+
+if __name__ == "__main__":
+    main()